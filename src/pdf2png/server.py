@@ -3,76 +3,147 @@ from mcp.server.models import InitializationOptions
 import mcp.types as types
 from mcp.server import NotificationOptions, Server
 import mcp.server.stdio
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+import io
 import os
+import sys
 import tempfile
-import re
-from urllib.request import urlopen, Request
+import logging
+import logging.handlers
+import queue
+import aiohttp
 from concurrent.futures import ThreadPoolExecutor
-import json
+from typing import IO
 from base64 import b64encode
+from mimetypes import guess_type
 
 server = Server("pdf2png")
 
-# Helper: Check if string is a URL
-def is_url(path: str) -> bool:
-    return re.match(r'^https?://', path) is not None
-
-
-# Synchronous helper: download file from URL to local path
-def download_file(url: str, filepath: str) -> None:
-    with urlopen(url) as response:
-        with open(filepath, 'wb') as f:
-            while True:
-                chunk = response.read(8192)
-                if not chunk:
-                    break
-                f.write(chunk)
+logger = logging.getLogger("pdf2png")
 
+# Shared worker pool for blocking I/O, installed as the loop's default executor
+_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("PDF2PNG_THREADS", 16)))
 
-# Synchronous helper: POST file to URL using multipart/form-data + optional Basic Auth
-def post_file(url: str, filepath: str, username: str | None = None, password: str | None = None) -> None:
-    from mimetypes import guess_type
+# Maximum number of PNG uploads in flight per request
+_UPLOAD_CONCURRENCY = max(1, int(os.environ.get("PDF2PNG_UPLOAD_CONCURRENCY", 8)))
 
-    # Read file content
-    with open(filepath, 'rb') as f:
-        file_data = f.read()
+# Read size for streaming PDF downloads
+_DOWNLOAD_CHUNK = 512 * 1024
 
-    # Prepare multipart form data
-    boundary = b'------------------------' + str(hash(url)).encode()
-    headers = {
-        'Content-Type': f'multipart/form-data; boundary={boundary.decode()}'
-    }
+# zlib level for PNGs encoded in memory for upload (1 = fastest)
+_PNG_COMPRESS_LEVEL = int(os.environ.get("PDF2PNG_COMPRESS_LEVEL", 1))
 
-    # Add Basic Auth if credentials provided
-    if username and password:
-        credentials = f"{username}:{password}".encode()
-        auth_header = b"Basic " + b64encode(credentials)
-        headers['Authorization'] = auth_header
+# Number of pdftoppm processes used to render pages in parallel
+_RENDER_THREADS = os.cpu_count() or 1
 
-    # Build body
-    body_parts = []
-    filename = os.path.basename(filepath)
-    mime_type = guess_type(filename)[0] or 'application/octet-stream'
+# Pages rendered per convert_from_path call when uploading; bounds pages held in memory per worker.
+# Each call also runs pdf2image's pdfinfo and `pdftoppm -v` probes. Those only read the PDF's
+# structure and version, which is cheap next to rasterising 8 pages, so the batch size is sized to
+# amortise them rather than bypassing pdf2image for a bare pdftoppm call.
+_RENDER_BATCH_PAGES = max(1, int(os.environ.get("PDF2PNG_RENDER_BATCH", 8)))
 
-    body_parts.extend([
-        b'--' + boundary,
-        f'Content-Disposition: form-data; name="file"; filename="{filename}"'.encode(),
-        f'Content-Type: {mime_type}'.encode(),
-        b'',
-        file_data
-    ])
+# Shared HTTP session for downloads and uploads, open for the server's lifetime
+_http_session: aiohttp.ClientSession | None = None
+# Bound connects and stalled reads only, so large downloads on slow links are not cut off
+_HTTP_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=300)
 
-    # Final boundary
-    body_parts.extend([b'--' + boundary + b'--', b''])
+# URL schemes accepted for remote PDFs
+_URL_PREFIXES = ("http://", "https://")
 
-    body = b'\r\n'.join(body_parts)
+# Helper: Check if string is a URL
+def is_url(path: str) -> bool:
+    return path[:8].lower().startswith(_URL_PREFIXES)
+
+
+# Helper: reject URLs with a scheme other than http(s) before any file work
+def check_read_path(path: str) -> None:
+    scheme, sep, _ = path.partition("://")
+    if sep and scheme.isascii() and scheme.isalpha() and not is_url(path):
+        raise ValueError(f"Unsupported URL scheme in 'read_file_path': {path}")
+
+
+# Helper: open the shared aiohttp session at server startup
+def open_http_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(timeout=_HTTP_TIMEOUT)
+    return _http_session
+
+
+# Helper: get the shared aiohttp session opened by main()
+def get_http_session() -> aiohttp.ClientSession:
+    if _http_session is None or _http_session.closed:
+        raise RuntimeError("HTTP session is not open; start the server with main()")
+    return _http_session
+
+
+# Async helper: close the shared aiohttp session, if any
+async def close_http_session() -> None:
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+# Async helper: stream file from URL into an open binary file
+async def download_file(url: str, f: IO[bytes]) -> None:
+    session = get_http_session()
+    loop = asyncio.get_running_loop()
+    async with session.get(url) as response:
+        response.raise_for_status()
+        async for chunk in response.content.iter_chunked(_DOWNLOAD_CHUNK):
+            await loop.run_in_executor(None, f.write, chunk)
+
+
+# Synchronous helper: render PDF pages straight to PNG files named page_N.png
+def render_pages(pdf_path: str, out_dir: str) -> list[str]:
+    os.makedirs(out_dir, exist_ok=True)
+    # pdftoppm writes the PNGs itself; uuid prefixes keep them apart from existing files
+    rendered = convert_from_path(
+        pdf_path,
+        thread_count=_RENDER_THREADS,
+        fmt='png',
+        output_folder=out_dir,
+        paths_only=True,
+    )
+    output_files = []
+    for i, rendered_path in enumerate(rendered):
+        output_path = os.path.join(out_dir, f'page_{i+1}.png')
+        os.replace(rendered_path, output_path)
+        output_files.append(output_path)
+    return output_files
+
+
+# Synchronous helper: render a contiguous page range to in-memory PNGs
+def render_pages_png(pdf_path: str, first_page: int, last_page: int) -> list[io.BytesIO]:
+    images = convert_from_path(pdf_path, first_page=first_page, last_page=last_page)
+    buffers = []
+    for image in images:
+        buf = io.BytesIO()
+        image.save(buf, 'PNG', compress_level=_PNG_COMPRESS_LEVEL)
+        buf.seek(0)
+        buffers.append(buf)
+    return buffers
+
+
+# Helper: build a Basic Auth header value, or None if credentials are incomplete
+def basic_auth_header(username: str | None, password: str | None) -> str | None:
+    if not (username and password):
+        return None
+    credentials = f"{username}:{password}".encode()
+    return "Basic " + b64encode(credentials).decode()
+
+
+# Async helper: POST file object to URL over a pooled session as multipart/form-data + optional precomputed Authorization header
+async def post_file(session: aiohttp.ClientSession, url: str, fileobj: IO[bytes], filename: str, auth_header: str | None = None) -> None:
+    mime_type = guess_type(filename)[0] or 'application/octet-stream'
+    headers = {'Authorization': auth_header} if auth_header else None
 
-    # Send request
-    req = Request(url, data=body, headers=headers)
-    with urlopen(req) as response:
+    form = aiohttp.FormData()
+    form.add_field('file', fileobj, filename=filename, content_type=mime_type)
+    async with session.post(url, data=form, headers=headers) as response:
         if response.status >= 400:
-            raise Exception(f"HTTP {response.status}: {response.read().decode()}")
+            raise Exception(f"HTTP {response.status}: {await response.text()}")
 
 
 @server.list_tools()
@@ -93,7 +164,7 @@ async def handle_list_tools() -> list[types.Tool]:
         ),
         types.Tool(
             name="pdf2png_upload",
-            description="Converts PDF to PNG images, uploads them via POST to a URL with optional Basic Auth, then deletes local files. Accepts local paths or URLs.",
+            description="Converts PDF to PNG images in memory and uploads them via POST to a URL with optional Basic Auth. No PNGs are written locally, so 'write_folder_path' is ignored. Accepts local paths or URLs.",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -103,7 +174,7 @@ async def handle_list_tools() -> list[types.Tool]:
                     "auth_username": {"type": "string", "nullable": True},
                     "auth_password": {"type": "string", "nullable": True},
                 },
-                "required": ["read_file_path", "upload_url", "write_folder_path"],
+                "required": ["read_file_path", "upload_url"],
             },
         ),
     ]
@@ -133,29 +204,17 @@ async def _convert_pdf_only(arguments: dict) -> list[types.TextContent]:
 
     if not read_file_path or not write_folder_path:
         raise ValueError("Missing 'read_file_path' or 'write_folder_path'")
+    check_read_path(read_file_path)
 
     temp_pdf_path = None
     try:
         if is_url(read_file_path):
-            loop = asyncio.get_event_loop()
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_pdf:
-                temp_pdf_path = tmp_pdf.name
-                await loop.run_in_executor(
-                    ThreadPoolExecutor(max_workers=1),
-                    download_file,
-                    read_file_path,
-                    temp_pdf_path
-                )
+            fd, temp_pdf_path = tempfile.mkstemp(suffix=".pdf")
+            with os.fdopen(fd, 'wb') as tmp_pdf:
+                await download_file(read_file_path, tmp_pdf)
             read_file_path = temp_pdf_path
 
-        images = convert_from_path(read_file_path)
-        os.makedirs(write_folder_path, exist_ok=True)
-
-        output_files = []
-        for i, image in enumerate(images):
-            output_path = os.path.join(write_folder_path, f'page_{i+1}.png')
-            image.save(output_path, 'PNG')
-            output_files.append(output_path)
+        output_files = await asyncio.to_thread(render_pages, read_file_path, write_folder_path)
 
         return [
             types.TextContent(
@@ -165,110 +224,159 @@ async def _convert_pdf_only(arguments: dict) -> list[types.TextContent]:
         ]
 
     finally:
-        if temp_pdf_path and os.path.exists(temp_pdf_path):
+        if temp_pdf_path:
             try:
                 os.unlink(temp_pdf_path)
-            except Exception as e:
-                print(f"Warning: Failed to delete temp file {temp_pdf_path}: {e}")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Failed to delete temp file %s: %s", temp_pdf_path, e)
 
 
 async def _convert_and_upload_pdf(arguments: dict) -> list[types.TextContent]:
-    """Internal helper: Convert PDF, upload PNGs, then delete locally with optional Basic Auth"""
+    """Internal helper: Convert PDF to in-memory PNGs and upload them with optional Basic Auth"""
     read_file_path = arguments.get("read_file_path")
     upload_url = arguments.get("upload_url")
-    write_folder_path = arguments.get("write_folder_path")
     auth_username = arguments.get("auth_username")  # Optional
     auth_password = arguments.get("auth_password")  # Optional
 
-    if not read_file_path or not upload_url or not write_folder_path:
-        raise ValueError("Missing required fields: 'read_file_path', 'upload_url', or 'write_folder_path'")
+    if not read_file_path or not upload_url:
+        raise ValueError("Missing required fields: 'read_file_path' or 'upload_url'")
+    check_read_path(read_file_path)
 
     temp_pdf_path = None
-    created_pngs = []
 
     try:
         # Step 1: Download PDF if URL
         if is_url(read_file_path):
-            loop = asyncio.get_event_loop()
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_pdf:
-                temp_pdf_path = tmp_pdf.name
-                await loop.run_in_executor(
-                    ThreadPoolExecutor(max_workers=1),
-                    download_file,
-                    read_file_path,
-                    temp_pdf_path
-                )
+            fd, temp_pdf_path = tempfile.mkstemp(suffix=".pdf")
+            with os.fdopen(fd, 'wb') as tmp_pdf:
+                await download_file(read_file_path, tmp_pdf)
             read_file_path = temp_pdf_path
 
-        # Step 2: Convert PDF to PNGs
-        images = convert_from_path(read_file_path)
-        os.makedirs(write_folder_path, exist_ok=True)
-
-        for i, image in enumerate(images):
-            output_path = os.path.join(write_folder_path, f'page_{i+1}.png')
-            image.save(output_path, 'PNG')
-            created_pngs.append(output_path)
-
-        if not created_pngs:
+        # Step 2: Count pages so they can be split into render batches
+        info = await asyncio.to_thread(pdfinfo_from_path, read_file_path)
+        page_count = int(info.get("Pages", 0))
+        if not page_count:
             raise ValueError("No pages were generated from PDF")
 
-        # Step 3: Upload each PNG with optional Basic Auth
-        uploaded_count = 0
-        loop = asyncio.get_event_loop()
-
-        for png_path in created_pngs:
-            try:
-                await loop.run_in_executor(
-                    ThreadPoolExecutor(max_workers=1),
-                    post_file,
-                    upload_url,
-                    png_path,
-                    auth_username,
-                    auth_password
-                )
-                uploaded_count += 1
-                print(f"Uploaded: {png_path}")
-            except Exception as e:
-                print(f"Failed to upload {png_path}: {e}")
-
-        # Step 4: Delete all local PNGs after upload
-        for png_path in created_pngs:
-            try:
-                os.unlink(png_path)
-            except Exception as e:
-                print(f"Warning: Failed to delete local file {png_path}: {e}")
+        # Step 3: Workers render contiguous page batches and upload each batch before
+        # rendering the next, so at most _RENDER_THREADS batches are held at once
+        auth_header = basic_auth_header(auth_username, auth_password)
+        session = get_http_session()
+        upload_sem = asyncio.Semaphore(_UPLOAD_CONCURRENCY)
+        batches = iter(range(1, page_count + 1, _RENDER_BATCH_PAGES))
+        stop = asyncio.Event()
+        upload_tasks: set[asyncio.Task] = set()
+
+        async def _upload_one(filename: str, png_buf: io.BytesIO) -> bool:
+            async with upload_sem:
+                try:
+                    await post_file(session, upload_url, png_buf, filename, auth_header)
+                    logger.info("Uploaded: %s", filename)
+                    return True
+                except Exception as e:
+                    logger.warning("Failed to upload %s: %s", filename, e)
+                    return False
+
+        async def _worker() -> int:
+            uploaded = 0
+            for first_page in batches:
+                if stop.is_set():
+                    break
+                last_page = min(first_page + _RENDER_BATCH_PAGES - 1, page_count)
+                png_bufs = await asyncio.to_thread(render_pages_png, read_file_path, first_page, last_page)
+                if stop.is_set():
+                    break
+                uploads = [
+                    asyncio.create_task(_upload_one(f'page_{first_page + i}.png', png_buf))
+                    for i, png_buf in enumerate(png_bufs)
+                ]
+                upload_tasks.update(uploads)
+                results = await asyncio.gather(*uploads, return_exceptions=True)
+                upload_tasks.difference_update(uploads)
+                uploaded += sum(result is True for result in results)
+            return uploaded
+
+        worker_count = min(_RENDER_THREADS, -(-page_count // _RENDER_BATCH_PAGES))
+        workers = [asyncio.create_task(_worker()) for _ in range(worker_count)]
+        try:
+            await asyncio.wait(workers, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            # On failure or cancellation, stop taking new batches and drop pending uploads.
+            # Workers are never cancelled: a render already running in a thread keeps reading
+            # the PDF, so wait for it before the temp PDF is removed.
+            stop.set()
+            for upload in upload_tasks:
+                upload.cancel()
+            worker_results = await asyncio.gather(*workers, return_exceptions=True)
+        for result in worker_results:
+            if isinstance(result, BaseException):
+                raise result
+        uploaded_count = sum(worker_results)
 
         auth_str = f" with Basic Auth" if auth_username else " without authentication"
         return [
             types.TextContent(
                 type="text",
-                text=f"Successfully converted PDF to {len(created_pngs)} PNG files, uploaded {uploaded_count} of them to {upload_url}{auth_str}, and deleted local copies."
+                text=f"Successfully converted PDF to {page_count} PNG files and uploaded {uploaded_count} of them to {upload_url}{auth_str}."
             )
         ]
 
     finally:
         # Clean up temporary PDF if it was downloaded
-        if temp_pdf_path and os.path.exists(temp_pdf_path):
+        if temp_pdf_path:
             try:
                 os.unlink(temp_pdf_path)
-            except Exception as e:
-                print(f"Warning: Failed to delete temp PDF file {temp_pdf_path}: {e}")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Failed to delete temp PDF file %s: %s", temp_pdf_path, e)
+
+
+# Helper: route log records through a queue so formatting and writes happen off the event loop.
+# Records go to stderr, since stdout carries the MCP stdio protocol.
+def start_logging() -> logging.handlers.QueueListener:
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener.start()
+    return listener
+
+
+# Helper: stop the log listener and detach the queue handler that fed it
+def stop_logging(listener: logging.handlers.QueueListener) -> None:
+    listener.stop()
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler) and handler.queue is listener.queue:
+            logger.removeHandler(handler)
 
 
 async def main():
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="pdf2png",
-                server_version="0.1.0",
-                capabilities=server.get_capabilities(
-                    notification_options=NotificationOptions(),
-                    experimental_capabilities={},
+    asyncio.get_running_loop().set_default_executor(_EXECUTOR)
+    log_listener = start_logging()
+    open_http_session()
+    try:
+        async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+            await server.run(
+                read_stream,
+                write_stream,
+                InitializationOptions(
+                    server_name="pdf2png",
+                    server_version="0.1.0",
+                    capabilities=server.get_capabilities(
+                        notification_options=NotificationOptions(),
+                        experimental_capabilities={},
+                    ),
                 ),
-            ),
-        )
+            )
+    finally:
+        await close_http_session()
+        stop_logging(log_listener)
 
 if __name__ == "__main__":
     asyncio.run(main())